@@ -2,23 +2,50 @@ import asyncio
 import aiohttp
 from aiohttp import web
 from erorr.erorr import ServerSide
-from src.server import protection, RequestHandler
+from src.server import (
+    protection,
+    RequestHandler,
+    AdmissionControl,
+    Settings,
+    Cluster,
+    Trace,
+)
+from src.JsonHandler import Store
 from aiohttp_middlewares import https_middleware
 
 # define class
 ProtectionServer = protection()
 ReqeustHandel = RequestHandler()
+Admission = AdmissionControl()
 
 app = web.Application(
     middlewares=[
+        Trace.Tracing,
+        # whitelist and rate limit first, so rejected IPs never queue for a slot
         ProtectionServer.RateLimiter,
+        Admission.Admission,
         https_middleware(),
     ]
 )
+# hot reload of config.json (SIGHUP or file change)
+app.on_startup.append(Settings.Start)
+app.on_cleanup.append(Settings.Stop)
+# replica session and hinted handoff
+app.on_startup.append(Cluster.Start)
+app.on_cleanup.append(Cluster.Stop)
+# finish the last pending write of output.json
+app.on_cleanup.append(Store.Close)
+
 app.router.add_get("/api/v1/get", ReqeustHandel.Recive)
 app.router.add_post("/api/v1/post", ReqeustHandel.Recive)
 app.router.add_delete("/api/v1/delete", ReqeustHandel.Recive)
+app.router.add_get("/api/v1/watch", ReqeustHandel.Watch)
 app.router.add_get("/api/v1/ceknode/Ping", ReqeustHandel.PingPong)
+app.router.add_get("/api/v1/ceknode/Stats", Admission.Stats)
+app.router.add_get("/api/v1/ceknode/Replication", Cluster.Stats)
+app.router.add_post("/api/v1/replica/write", Cluster.ReplicaWrite)
+app.router.add_post("/api/v1/replica/read", Cluster.ReplicaRead)
+app.router.add_post("/api/v1/admin/profile", Trace.Profile)
 
 # run server
 if __name__ == "__main__":
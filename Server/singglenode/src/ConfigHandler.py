@@ -0,0 +1,277 @@
+import os
+import json
+import signal
+import asyncio
+import logging
+import ipaddress
+
+from erorr.erorr import ValidationError, JsonError
+
+
+# markers for `ConfigLoader.Check`
+Number = object()
+StrList = object()
+
+# optional ServerConfig sections and the type of each key in them
+OptionalSections = {
+    "RateLimit": {"MaxRequests": Number, "WindowSeconds": Number},
+    "Admission": {
+        "MaxConcurrent": Number,
+        "MaxQueue": Number,
+        "MaxPriorityQueue": Number,
+        "DeadlineSeconds": Number,
+        "PriorityPaths": StrList,
+        "StreamPaths": StrList,
+    },
+    "Watch": {"MaxSubscribers": Number, "KeepAliveSeconds": Number},
+    "Tracing": {
+        "Enabled": bool,
+        "SlowRequestMs": Number,
+        "SkipPaths": StrList,
+        "MaxProfileSeconds": Number,
+    },
+    "Replication": {
+        "Port": Number,
+        "ReadConsistency": str,
+        "WriteConsistency": str,
+        "Collections": dict,
+        "TimeoutSeconds": Number,
+        "HintInterval": Number,
+        "MaxHints": Number,
+        "TombstoneSeconds": Number,
+    },
+}
+
+
+class IpTrie:
+    """
+    The `IpTrie` class is a compiled IP whitelist. Every entry (a single address or an
+    IPv4/IPv6 CIDR range) is stored as a path of bits in a binary trie, so a lookup walks
+    at most as many nodes as the longest matching prefix instead of scanning the whole list.
+
+    Methods:
+    --------
+    - Add: Inserts an address or CIDR range.
+    - Contains: Checks whether an address falls inside any inserted range.
+
+    Example:
+    --------
+    ```python
+    trie = IpTrie(["192.168.100.0/24", "10.0.0.7", "2001:db8::/32"])
+    trie.Contains("192.168.100.14")  # True
+    ```
+    """
+
+    def __init__(self, entries: list = ()):
+        # one root per address family, a node is [child0, child1, terminal]
+        self.roots = {4: [None, None, False], 6: [None, None, False]}
+        for entry in entries:
+            self.Add(entry)
+
+    def Add(self, entry: str):
+        try:
+            network = ipaddress.ip_network(entry, strict=False)
+        except (ValueError, TypeError):
+            raise ValidationError(f"invalid whitelist entry: {entry!r}")
+        mapped = network.version == 6 and network.network_address.ipv4_mapped
+        if mapped and network.prefixlen >= 96:
+            # store ::ffff:a.b.c.d/n as IPv4, the same way `Contains` looks it up
+            network = ipaddress.ip_network(f"{mapped}/{network.prefixlen - 96}")
+        bits = int(network.network_address)
+        width = network.max_prefixlen
+        node = self.roots[network.version]
+        for index in range(network.prefixlen):
+            bit = (bits >> (width - 1 - index)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, False]
+            node = node[bit]
+        node[2] = True
+
+    def Contains(self, IpAddr: str):
+        try:
+            address = ipaddress.ip_address(IpAddr)
+        except ValueError:
+            return False
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        bits = int(address)
+        width = address.max_prefixlen
+        node = self.roots[address.version]
+        for index in range(width):
+            if node[2]:
+                return True
+            node = node[(bits >> (width - 1 - index)) & 1]
+            if node is None:
+                return False
+        return node[2]
+
+
+class ConfigLoader:
+    """
+    The `ConfigLoader` class owns the live `config.json`. It validates the file, compiles
+    the IP whitelist into an `IpTrie` and swaps both in atomically, so a request always
+    sees one complete configuration. The file is reloaded on SIGHUP or when its
+    modification time changes, without restarting the server.
+
+    Attributes:
+    ------------
+    - path: Location of the configuration file.
+    - Config: The current, validated configuration dictionary.
+    - Whitelist: The compiled whitelist matching `Config`.
+
+    Methods:
+    ---------
+    - Load: Reads, validates and compiles the file, returning the new state.
+    - Reload: Loads the file and swaps it in; keeps the old config if it is invalid.
+    - Start / Stop: aiohttp startup/cleanup hooks for the SIGHUP handler and file watcher.
+
+    Example:
+    --------
+    ```python
+    Settings = ConfigLoader("config.json")
+    app.on_startup.append(Settings.Start)
+    app.on_cleanup.append(Settings.Stop)
+    ```
+    """
+
+    def __init__(self, path: str = "config.json"):
+        self.path = path
+        self.logger = logging.getLogger(__name__)
+        self.watcher = None
+        config, whitelist, self.mtime = self.Load()
+        self.State = (config, whitelist)
+
+    @property
+    def Config(self):
+        return self.State[0]
+
+    @property
+    def Whitelist(self):
+        return self.State[1]
+
+    def Load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+            with open(self.path, "rb") as Cfg:
+                config = json.load(Cfg)
+        except ValueError:
+            raise JsonError(f"{self.path} is not valid JSON")
+        self.Validate(config)
+        whitelist = IpTrie(
+            config["Config"]["ServerConfig"]["WhitelistIP"].get("IpAllowLst", [])
+        )
+        return config, whitelist, mtime
+
+    def Validate(self, config: dict):
+        if not isinstance(config, dict):
+            raise ValidationError(f"{self.path} must hold a JSON object")
+        ServerConfig = self.Section(
+            self.Section(config, "Config", ""), "ServerConfig", "Config."
+        )
+        TokenConfig = self.Section(config["Config"], "TokenConfig", "Config.")
+        self.Check(ServerConfig, "LogActivity", bool, "ServerConfig.")
+        self.Check(ServerConfig, "ratelimiter", bool, "ServerConfig.", required=False)
+        self.Check(ServerConfig, "ReloadInterval", Number, "ServerConfig.", False)
+        self.Check(TokenConfig, "secretKey", str, "TokenConfig.")
+        self.Check(TokenConfig, "duration", Number, "TokenConfig.")
+
+        WhitelistIP = self.Section(ServerConfig, "WhitelistIP", "ServerConfig.")
+        self.Check(WhitelistIP, "UseWhitelist", bool, "WhitelistIP.")
+        self.Check(WhitelistIP, "IpAllowLst", StrList, "WhitelistIP.", False)
+        dualNode = self.Section(ServerConfig, "dualNode", "ServerConfig.")
+        self.Check(dualNode, "UseNode", bool, "dualNode.")
+        self.Check(dualNode, "NodeIp", str, "dualNode.")
+        pool = self.Section(ServerConfig, "pool", "ServerConfig.")
+        self.Check(pool, "UsePool", bool, "pool.")
+        self.Check(pool, "NodeIp", StrList, "pool.")
+
+        # optional sections, every key in them is optional too
+        for name, keys in OptionalSections.items():
+            section = self.Section(ServerConfig, name, "ServerConfig.", required=False)
+            for key, kind in keys.items():
+                self.Check(section, key, kind, f"{name}.", required=False)
+
+        Replication = ServerConfig.get("Replication", {})
+        levels = [Replication.get("ReadConsistency", "QUORUM")]
+        levels.append(Replication.get("WriteConsistency", "QUORUM"))
+        for prefix, collection in Replication.get("Collections", {}).items():
+            where = f"Replication.Collections.{prefix}"
+            if not isinstance(collection, dict):
+                raise ValidationError(f"{where} must be an object")
+            levels.append(collection.get("read", "QUORUM"))
+            levels.append(collection.get("write", "QUORUM"))
+        for level in levels:
+            if level not in ("ONE", "QUORUM", "ALL"):
+                raise ValidationError(f"unknown consistency level {level!r}")
+
+    def Section(self, parent: dict, name: str, where: str, required: bool = True):
+        if name not in parent and not required:
+            return {}
+        if not isinstance(parent.get(name), dict):
+            raise ValidationError(f"{where}{name} must be an object")
+        return parent[name]
+
+    def Check(self, section: dict, key: str, kind, where: str, required: bool = True):
+        if key not in section:
+            if required:
+                raise ValidationError(f"missing config key {where}{key}")
+            return
+        value = section[key]
+        if kind is Number:
+            # bool is an int subclass, but `true` is not a valid limit
+            valid = isinstance(value, (int, float)) and not isinstance(value, bool)
+            valid = valid and value > 0
+            expected = "a positive number"
+        elif kind is StrList:
+            valid = isinstance(value, list) and all(isinstance(v, str) for v in value)
+            expected = "a list of strings"
+        else:
+            valid = isinstance(value, kind)
+            expected = {bool: "true or false", str: "a string", dict: "an object"}[kind]
+        if not valid:
+            raise ValidationError(f"{where}{key} must be {expected}")
+
+    def Reload(self):
+        try:
+            config, whitelist, mtime = self.Load()
+        except (OSError, JsonError, ValidationError) as err:
+            self.logger.error(f"config reload rejected, keeping old config: {err}")
+            return False
+        # single assignment, readers see either the old or the new pair
+        self.State = (config, whitelist)
+        self.mtime = mtime
+        self.logger.info(f"config reloaded from {self.path}")
+        return True
+
+    async def Watch(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                continue
+            if mtime != self.mtime:
+                try:
+                    reloaded = self.Reload()
+                except Exception:
+                    # an unexpected bug must not end live reload until restart
+                    self.logger.exception("config reload failed, keeping old config")
+                    reloaded = False
+                if not reloaded:
+                    # don't retry the same broken file every tick
+                    self.mtime = mtime
+
+    async def Start(self, app=None):
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGHUP, self.Reload)
+        except (AttributeError, NotImplementedError, RuntimeError):
+            # no SIGHUP on this platform, the file watcher still works
+            pass
+        interval = self.Config["Config"]["ServerConfig"].get("ReloadInterval", 2)
+        self.watcher = loop.create_task(self.Watch(interval))
+
+    async def Stop(self, app=None):
+        if self.watcher is not None:
+            self.watcher.cancel()
+            self.watcher = None
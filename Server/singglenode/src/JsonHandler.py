@@ -1,28 +1,460 @@
 import json
+import os
+import time
+import asyncio
+from collections import defaultdict, deque
+
+from erorr.erorr import JsonError, ValidationError, ServerSide
+from src.Tracing import Stage
+
+
+# marker for a deleted key inside the version chain
+Tombstone = object()
+
+
+class Snapshot:
+    """
+    The `Snapshot` class is a consistent, read-only view of the store at a single
+    sequence number. Every read through the same snapshot sees the same data, even
+    while writers keep committing new versions.
+
+    Methods:
+    --------
+    - Get: Returns the value of one key as of the snapshot.
+    - GetMany: Returns several keys read from the same point in time.
+    - Scan: Returns every key (optionally under a prefix) as of the snapshot.
+    - Release: Tells the store that the snapshot is no longer used.
+
+    Example:
+    --------
+    ```python
+    with Store.Snapshot() as snap:
+        user = snap.Get("user:1")
+        orders = snap.Scan(prefix="order:")
+    ```
+    """
+
+    def __init__(self, store, seq: int):
+        self.store = store
+        self.seq = seq
+        self.released = False
+
+    def Get(self, key: str, default=None):
+        value = self.store._ValueAt(key, self.seq)
+        return default if value is Tombstone else value
+
+    def GetMany(self, keys: list):
+        return {key: self.Get(key) for key in keys}
+
+    def Scan(self, prefix: str = ""):
+        result = {}
+        for key in sorted(self.store.versions):
+            if not key.startswith(prefix):
+                continue
+            value = self.store._ValueAt(key, self.seq)
+            if value is not Tombstone:
+                result[key] = value
+        return result
+
+    def Release(self):
+        if not self.released:
+            self.released = True
+            self.store._Release(self.seq)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.Release()
+
+
+class Subscriber:
+    """
+    The `Subscriber` class is one consumer of the `ChangeFeed`. Live events go into a
+    bounded queue; if the consumer falls behind and the queue fills up, the subscriber is
+    dropped instead of buffering without limit.
+
+    Methods:
+    --------
+    - Next: Waits for the next event, or returns `None` once the subscriber was dropped.
+    - Close: Detaches the subscriber from the feed.
+    """
+
+    def __init__(self, feed, prefix: str, backlog: list, QueueSize: int):
+        self.feed = feed
+        self.prefix = prefix
+        self.backlog = deque(backlog)
+        self.queue = asyncio.Queue(maxsize=QueueSize)
+        self.dropped = False
+
+    def Offer(self, event: dict):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped = True
+            self.feed.Unsubscribe(self)
+
+    async def Next(self):
+        if self.dropped:
+            return None
+        if self.backlog:
+            return self.backlog.popleft()
+        return await self.queue.get()
+
+    def Close(self):
+        self.feed.Unsubscribe(self)
+
+
+class ChangeFeed:
+    """
+    The `ChangeFeed` class is the write log of the store. Every committed put/delete is
+    recorded with its sequence number in a bounded log and pushed to the subscribers whose
+    key prefix matches, so integrators can react to changes instead of polling.
+
+    Attributes:
+    ------------
+    - log: The most recent `LogSize` events, oldest first, used to resume a subscriber.
+    - trimmed: The sequence number of the newest event dropped from `log`.
+    - subscribers: The currently attached `Subscriber` objects.
+
+    Methods:
+    ---------
+    - Publish: Records the changes of one commit and fans them out.
+    - Subscribe: Attaches a subscriber, optionally replaying events after `since`.
+    - Unsubscribe: Detaches a subscriber.
+
+    Example:
+    --------
+    ```python
+    sub = Store.feed.Subscribe(prefix="user:", since=42)
+    event = await sub.Next()  # {"seq": 43, "op": "put", "key": "user:1", "value": ...}
+    ```
+    """
+
+    def __init__(self, LogSize: int = 10000, QueueSize: int = 256):
+        self.log = deque()
+        self.LogSize = LogSize
+        # seq of the newest event dropped from the log, resuming before it has gaps
+        self.trimmed = 0
+        self.QueueSize = QueueSize
+        self.subscribers = set()
+
+    def Publish(self, seq: int, changes: dict):
+        for key, value in changes.items():
+            if value is Tombstone:
+                event = {"seq": seq, "op": "delete", "key": key}
+            else:
+                event = {"seq": seq, "op": "put", "key": key, "value": value}
+            self.log.append(event)
+            if len(self.log) > self.LogSize:
+                self.trimmed = self.log.popleft()["seq"]
+            for sub in list(self.subscribers):
+                if key.startswith(sub.prefix):
+                    sub.Offer(event)
+
+    def Subscribe(self, prefix: str = "", since: int = None):
+        backlog = []
+        if since is not None:
+            # a commit can be partly trimmed, so only resume after the trimmed seq
+            if since < self.trimmed:
+                raise ValidationError(
+                    f"cannot resume from seq {since}, oldest complete is "
+                    f"{self.trimmed + 1}"
+                )
+            backlog = [
+                event
+                for event in self.log
+                if event["seq"] > since and event["key"].startswith(prefix)
+            ]
+        sub = Subscriber(self, prefix, backlog, self.QueueSize)
+        self.subscribers.add(sub)
+        return sub
+
+    def Unsubscribe(self, sub):
+        self.subscribers.discard(sub)
+
+
+class VersionStore:
+    """
+    The `VersionStore` class keeps the database in memory as a chain of versions per key
+    (multi-version concurrency control). Each write is stamped with a new sequence number,
+    readers take a `Snapshot` without any lock and never wait behind writers, and old
+    versions are dropped once no open snapshot can still see them.
+
+    Attributes:
+    ------------
+    - path: The JSON file the latest committed state is persisted to.
+    - seq: The sequence number of the last committed write.
+    - versions: Maps every key to a list of `(seq, value)` pairs, oldest first.
+    - feed: The `ChangeFeed` every commit is published to.
+
+    Methods:
+    ---------
+    - Snapshot: Opens a consistent read view at the current sequence number.
+    - Put: Commits a batch of key/value pairs as one version.
+    - Delete: Commits the removal of a batch of keys as one version.
+    - Watch: Subscribes to the change feed, optionally resuming after a sequence number.
+    - Apply / Stamped: Stamped writes and reads used by replication (last write wins).
+
+    Notes:
+    ------
+    - A commit is one synchronous step on the event loop (no `await` inside), so writers
+      never interleave and readers never take a lock.
+    - Writing `output.json` happens in a worker thread. Commits that land while a write
+      is running are coalesced into the next one (group commit), and `Put` / `Delete` /
+      `Apply` return once the file holding their version has been swapped in.
+    - The file is written to a temporary name and swapped in with `os.replace`, so a
+      reader of `output.json` never sees a half-written file.
+    - Garbage collection only visits keys written since it last ran.
+    - The stamp of a deleted key is kept for `TombstoneSeconds` (so an older write can't
+      bring it back), then forgotten.
+    - Write stamps live in memory only; after a restart every key starts at stamp 0 and
+      is brought up to date by read-repair or hinted handoff.
+    """
+
+    def __init__(self, path: str = "output.json"):
+        self.path = path
+        self.seq = 0
+        self.versions = defaultdict(list)
+        self.readers = defaultdict(int)
+        # latest committed value per key, the source of every file write
+        self.head = {}
+        # keys whose chain may still hold versions the GC can drop
+        self.touched = set()
+        self.persisted = 0
+        self.flusher = None
+        self.FlushError = None
+        self.Flushed = asyncio.Condition()
+        self.feed = ChangeFeed()
+        # write stamp per key (deleted keys included) for last-write-wins replication
+        self.stamps = {}
+        # highest stamp seen from any node, local stamps never go below it
+        self.HighStamp = 0
+        # (stamp, key) of deletes in stamp order, their stamps expire after a while
+        self.deleted = deque()
+        self.TombstoneSeconds = 86400
+        self.Load()
+
+    def Load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as infile:
+                data = json.load(infile)
+        except ValueError:
+            raise JsonError(f"{self.path} is not valid JSON")
+        if not isinstance(data, dict):
+            raise JsonError(f"{self.path} must hold a JSON object")
+        if data:
+            self.seq = self.persisted = 1
+            # what was loaded from disk is not in the change log
+            self.feed.trimmed = self.seq
+            for key, value in data.items():
+                self.versions[key].append((self.seq, value))
+            self.head = dict(data)
+
+    def Snapshot(self):
+        self.readers[self.seq] += 1
+        return Snapshot(self, self.seq)
+
+    def Watch(self, prefix: str = "", since: int = None):
+        return self.feed.Subscribe(prefix=prefix, since=since)
+
+    async def Put(self, items: dict, stamp: int = None):
+        if not isinstance(items, dict):
+            raise JsonError("Put expects a JSON object")
+        if stamp is not None:
+            return await self.Apply(
+                [[key, stamp, value, False] for key, value in items.items()]
+            )
+        return await self.Durable(self._Commit(dict(items)))
+
+    async def Delete(self, keys: list, stamp: int = None):
+        if stamp is not None:
+            return await self.Apply([[key, stamp, None, True] for key in keys])
+        return await self.Durable(
+            self._Commit({key: Tombstone for key in keys if key in self.head})
+        )
+
+    def NextStamp(self):
+        """Return a stamp newer than every stamp seen, even if the clock went back."""
+        self.HighStamp = max(time.time_ns(), self.HighStamp + 1)
+        return self.HighStamp
+
+    async def Apply(self, changes: list):
+        """
+        Commit `[key, stamp, value, deleted]` changes, the highest stamp wins. Returns the
+        seq, or None when a newer (or equal) stamp already won for one of the keys.
+        """
+        # before this batch, so every recorded delete is already committed
+        self._ExpireTombstones()
+        accepted = {}
+        rejected = False
+        for key, stamp, value, deleted in changes:
+            self.HighStamp = max(self.HighStamp, stamp)
+            if stamp <= self.stamps.get(key, 0):
+                rejected = True
+                continue
+            self.stamps[key] = stamp
+            if deleted:
+                self.deleted.append((stamp, key))
+                if key in self.head:
+                    accepted[key] = Tombstone
+            else:
+                accepted[key] = value
+        seq = await self.Durable(self._Commit(accepted))
+        return None if rejected else seq
+
+    def _ExpireTombstones(self):
+        """Forget the stamps of keys deleted more than `TombstoneSeconds` ago."""
+        cutoff = time.time_ns() - self.TombstoneSeconds * 10**9
+        while self.deleted and self.deleted[0][0] < cutoff:
+            stamp, key = self.deleted.popleft()
+            if self.stamps.get(key) == stamp and key not in self.head:
+                del self.stamps[key]
+
+    def Stamped(self, keys: list = None, prefix: str = ""):
+        """Return `{key: [stamp, value, deleted]}` from one snapshot, for replica reads."""
+        with Stage("JsonHandler.read"), self.Snapshot() as snap:
+            if keys is None:
+                keys = [
+                    key
+                    for key in set(self.versions) | set(self.stamps)
+                    if key.startswith(prefix)
+                ]
+            result = {}
+            for key in keys:
+                value = self._ValueAt(key, snap.seq)
+                result[key] = [
+                    self.stamps.get(key, 0),
+                    None if value is Tombstone else value,
+                    value is Tombstone,
+                ]
+            return result
+
+    async def Durable(self, seq: int):
+        """Wait until `output.json` holds version `seq` (or newer), then return `seq`."""
+        if seq <= self.persisted:
+            return seq
+        with Stage("JsonHandler.write"):
+            if self.flusher is None or self.flusher.done():
+                self.FlushError = None
+                self.flusher = asyncio.ensure_future(self._Flush())
+            async with self.Flushed:
+                await self.Flushed.wait_for(
+                    lambda: self.persisted >= seq or self.FlushError is not None
+                )
+            if self.persisted < seq:
+                # a disk fault, not the client's payload
+                raise ServerSide(f"could not write {self.path}: {self.FlushError}")
+        return seq
+
+    async def Close(self, app=None):
+        """Wait for the last pending file write, for the aiohttp cleanup hook."""
+        if self.flusher is not None:
+            await self.flusher
+
+    def _Commit(self, changes: dict):
+        if not changes:
+            return self.seq
+        seq = self.seq + 1
+        for key, value in changes.items():
+            self.versions[key].append((seq, value))
+            if value is Tombstone:
+                self.head.pop(key, None)
+            else:
+                self.head[key] = value
+        self.touched.update(changes)
+        # publish the new version only after every key has it
+        self.seq = seq
+        self._Collect()
+        self.feed.Publish(seq, changes)
+        return seq
+
+    async def _Flush(self):
+        loop = asyncio.get_running_loop()
+        while self.persisted < self.seq:
+            seq = self.seq
+            # a shallow copy is enough, stored values are never mutated in place
+            data = dict(self.head)
+            try:
+                await loop.run_in_executor(None, self._WriteFile, data)
+            except OSError as err:
+                self.FlushError = err
+            else:
+                self.persisted = seq
+                self.FlushError = None
+            async with self.Flushed:
+                self.Flushed.notify_all()
+            if self.FlushError is not None:
+                return
+
+    def _WriteFile(self, data: dict):
+        TmpPath = self.path + ".tmp"
+        with open(TmpPath, "w") as outfile:
+            json.dump(data, outfile, indent=4)
+        os.replace(TmpPath, self.path)
+
+    def _ValueAt(self, key: str, seq: int):
+        for version, value in reversed(self.versions.get(key, ())):
+            if version <= seq:
+                return value
+        return Tombstone
+
+    def _Release(self, seq: int):
+        self.readers[seq] -= 1
+        if self.readers[seq] <= 0:
+            del self.readers[seq]
+            # only the oldest reader going away lets the GC drop anything
+            if not self.readers or seq < min(self.readers):
+                self._Collect()
+
+    def _Collect(self):
+        """Drop versions that no open snapshot (or the head) can still read."""
+        oldest = min(self.readers, default=self.seq)
+        for key in list(self.touched):
+            chain = self.versions[key]
+            # keep the newest version visible to the oldest reader and all after it
+            keep = 0
+            for index, (version, _) in enumerate(chain):
+                if version <= oldest:
+                    keep = index
+            if keep:
+                del chain[:keep]
+            if len(chain) > 1:
+                continue
+            if chain[0][1] is not Tombstone:
+                self.touched.discard(key)
+            elif chain[0][0] <= oldest:
+                self.touched.discard(key)
+                del self.versions[key]
+
+
+Store = VersionStore()
 
 
 class WriteJson:
     def __init__(self):
-        self
+        self.store = Store
 
     async def Write(self, data):
-        with open("output.json", "w") as outfile:
-            json.dump(data, outfile, indent=4)
+        return await self.store.Put(data)
 
 
 class ReadJson:
     def __init__(self):
-        self
+        self.store = Store
 
-    async def Read(self):
-        with open("output.json", "r") as outfile:
-            data = json.load(outfile)
-        return data
+    async def Read(self, keys: list = None, prefix: str = ""):
+        with self.store.Snapshot() as snap:
+            if keys is not None:
+                return snap.GetMany(keys)
+            return snap.Scan(prefix=prefix)
 
 
 class DeleteJson:
     def __init__(self):
-        self
+        self.store = Store
 
-    async def Delete(self):
-        pass
+    async def Delete(self, keys: list):
+        return await self.store.Delete(keys)
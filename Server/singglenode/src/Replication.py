@@ -0,0 +1,394 @@
+import time
+import asyncio
+import logging
+from collections import defaultdict, deque
+
+import aiohttp
+from aiohttp import web
+
+from erorr.erorr import ValidationError, NetworkError, RequestError, ServerSide
+from src.JsonHandler import Store
+
+
+# errors meaning the replica could not be reached (or is overloaded), worth retrying
+Unreachable = (aiohttp.ClientError, asyncio.TimeoutError, NetworkError, ValueError)
+
+# how many replicas must answer for each consistency level, given the replica count
+Levels = {
+    "ONE": lambda total: 1,
+    "QUORUM": lambda total: total // 2 + 1,
+    "ALL": lambda total: total,
+}
+Strictness = ["ONE", "QUORUM", "ALL"]
+
+
+class Replicator:
+    """
+    The `Replicator` class coordinates reads and writes across the nodes of a pool (or the
+    dual node) with a tunable consistency level. Requests go to every replica in parallel
+    and return as soon as enough of them answered, so latency is set by the fastest
+    `ONE` / `QUORUM` replicas instead of the slowest node.
+
+    Attributes:
+    ------------
+    - settings: The live `ConfigLoader`; replicas and levels follow config reloads.
+    - guard: The `protection` instance used to sign and check node-to-node tokens.
+    - hints: Writes kept for replicas that were down, replayed by hinted handoff. A hint
+             the replica rejects (4xx) is logged and dropped instead of retried, and
+             hints older than `TombstoneSeconds` are dropped.
+    - stats: Counters for acks, failures, read-repairs and delivered or dropped hints.
+
+    Methods:
+    ---------
+    - Write: Stamps a batch of changes and replicates it with the write level.
+    - Read: Reads keys (or a prefix) with the read level, merges by stamp and repairs
+            stale replicas in the background.
+    - ReplicaWrite / ReplicaRead: Internal endpoints the other nodes call.
+    - Stats: Handler reporting failures, read-repairs and queued hints.
+    - Start / Stop: aiohttp startup/cleanup hooks for the HTTP session and hint delivery.
+
+    Notes:
+    ------
+    - Levels are `ONE`, `QUORUM` (majority, so the same as `ALL` with two nodes) and
+      `ALL`. They come from the `X-Consistency` header, else the longest matching
+      prefix in `Replication.Collections`, else the `ReadConsistency` /
+      `WriteConsistency` defaults.
+    - Conflicts are resolved by last write wins on a per-key stamp. Stamps come from
+      `time.time_ns()` but never go below the highest stamp seen plus one, and a
+      replica (the local one included) that keeps a newer write does not ack.
+    - Replicas are `pool.NodeIp` when the pool is on, otherwise `dualNode.NodeIp`. Each
+      node has to be in the other nodes' whitelist.
+
+    Example:
+    --------
+    ```python
+    Cluster = Replicator(Settings, protection())
+    seq = await Cluster.Write({"user:1": {"name": "falco"}}, level="QUORUM")
+    data = await Cluster.Read(keys=["user:1"], level="ONE")
+    ```
+    """
+
+    def __init__(self, settings, guard):
+        self.settings = settings
+        self.guard = guard
+        self.logger = logging.getLogger(__name__)
+        self.session = None
+        self.deliverer = None
+        self.hints = defaultdict(deque)
+        # replica calls still running after the request already returned
+        self.pending = set()
+        self.stats = {
+            "writeFailed": 0,
+            "readFailed": 0,
+            "repairs": 0,
+            "hintsSent": 0,
+            "hintsDropped": 0,
+        }
+
+    @property
+    def ReplicationCfg(self):
+        return self.settings.Config["Config"]["ServerConfig"].get("Replication", {})
+
+    @property
+    def TombstoneSeconds(self):
+        return self.ReplicationCfg.get("TombstoneSeconds", 86400)
+
+    @property
+    def Replicas(self):
+        ServerConfig = self.settings.Config["Config"]["ServerConfig"]
+        if ServerConfig["pool"]["UsePool"]:
+            nodes = ServerConfig["pool"]["NodeIp"]
+        elif ServerConfig["dualNode"]["UseNode"]:
+            nodes = [ServerConfig["dualNode"]["NodeIp"]]
+        else:
+            nodes = []
+        port = self.ReplicationCfg.get("Port", 8080)
+        return [node if "://" in node else f"http://{node}:{port}" for node in nodes]
+
+    def Level(self, kind: str, keys: list, requested: str = None):
+        if requested:
+            requested = requested.upper()
+            if requested not in Levels:
+                raise ValidationError(f"unknown consistency level {requested!r}")
+            return requested
+        default = self.ReplicationCfg.get(f"{kind}Consistency", "QUORUM")
+        collections = self.ReplicationCfg.get("Collections", {})
+        levels = []
+        for key in keys:
+            matches = [prefix for prefix in collections if key.startswith(prefix)]
+            collection = collections[max(matches, key=len)] if matches else {}
+            levels.append(collection.get(kind.lower(), default))
+        # a batch touching several collections uses the strictest of them
+        return max(levels, key=Strictness.index, default=default)
+
+    async def Token(self):
+        return await self.guard.TokenHandler(
+            self.settings.Config["Config"]["TokenConfig"]["secretKey"]
+        )
+
+    async def Call(self, node: str, path: str, payload: dict):
+        timeout = aiohttp.ClientTimeout(
+            total=self.ReplicationCfg.get("TimeoutSeconds", 2)
+        )
+        async with self.session.post(
+            node + path,
+            json=payload,
+            headers={"X-Node-Token": await self.Token()},
+            timeout=timeout,
+        ) as response:
+            if response.status in (408, 429) or response.status >= 500:
+                raise NetworkError(f"{node} answered {response.status}")
+            if response.status != 200:
+                # the replica is up but refuses this payload, retrying won't help
+                raise RequestError(f"{node} rejected the call with {response.status}")
+            return (await response.json())["Response"]
+
+    def Background(self, coro):
+        task = asyncio.ensure_future(coro)
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+        return task
+
+    async def Gather(self, calls: list, need: int):
+        """Wait until `need` of `calls` (coroutines returning a result or None) succeed."""
+        tasks = [self.Background(call) for call in calls]
+        results = []
+        for done in asyncio.as_completed(tasks):
+            result = await done
+            if result is not None:
+                results.append(result)
+                if len(results) >= need:
+                    break
+        # the remaining tasks keep running in the background
+        return results
+
+    async def Write(self, items: dict = None, deletes: list = None, level: str = None):
+        items = items or {}
+        deletes = deletes or []
+        stamp = Store.NextStamp()
+        changes = [[key, stamp, value, False] for key, value in items.items()]
+        changes += [[key, stamp, None, True] for key in deletes]
+        replicas = self.Replicas
+        need = Levels[self.Level("Write", list(items) + deletes, level)](
+            len(replicas) + 1
+        )
+
+        failed = []
+
+        async def Local():
+            try:
+                # None when a newer write already won here, that is not an ack
+                return await Store.Apply(changes)
+            except ServerSide as err:
+                # the other replicas may still reach the write level
+                self.logger.error(f"local write failed: {err}")
+                failed.append(err)
+                return None
+
+        results = await self.Gather(
+            [Local()] + [self.Send(node, changes) for node in replicas], need
+        )
+        if len(results) < need:
+            self.stats["writeFailed"] += 1
+            if failed:
+                raise failed[0]
+            raise NetworkError(f"only {len(results)} of {need} replicas acknowledged")
+        return Store.seq
+
+    async def Send(self, node: str, changes: list):
+        try:
+            await self.Call(node, "/api/v1/replica/write", {"changes": changes})
+            return True
+        except Unreachable:
+            self.Hint(node, changes)
+            return None
+        except RequestError as err:
+            self.logger.error(f"replica write dropped: {err}")
+            return None
+
+    def Hint(self, node: str, changes: list):
+        hints = self.hints[node]
+        hints.append(changes)
+        while len(hints) > self.ReplicationCfg.get("MaxHints", 10000):
+            # oldest hints go first, read-repair still fixes those keys later
+            hints.popleft()
+
+    async def Read(self, keys: list = None, prefix: str = "", level: str = None):
+        replicas = self.Replicas
+        need = Levels[self.Level("Read", keys or [prefix], level)](len(replicas) + 1)
+        payload = {"keys": keys, "prefix": prefix}
+
+        async def Local():
+            return (None, Store.Stamped(keys=keys, prefix=prefix))
+
+        async def Remote(node):
+            try:
+                return (node, await self.Call(node, "/api/v1/replica/read", payload))
+            except (*Unreachable, RequestError):
+                return None
+
+        answers = await self.Gather(
+            [Local()] + [Remote(node) for node in replicas], need
+        )
+        if len(answers) < need:
+            self.stats["readFailed"] += 1
+            raise NetworkError(f"only {len(answers)} of {need} replicas answered")
+
+        latest = {}
+        for _, entries in answers:
+            for key, entry in entries.items():
+                if key not in latest or entry[0] > latest[key][0]:
+                    latest[key] = entry
+        self.Repair(answers, latest)
+
+        if keys is not None:
+            return {
+                key: None if key not in latest or latest[key][2] else latest[key][1]
+                for key in keys
+            }
+        return {key: entry[1] for key, entry in sorted(latest.items()) if not entry[2]}
+
+    def Repair(self, answers: list, latest: dict):
+        for node, entries in answers:
+            stale = [
+                [key, entry[0], entry[1], entry[2]]
+                for key, entry in latest.items()
+                if entries.get(key, [0])[0] < entry[0]
+            ]
+            if not stale:
+                continue
+            self.stats["repairs"] += 1
+            if node is None:
+                self.Background(Store.Apply(stale))
+            else:
+                self.Background(self.Send(node, stale))
+
+    async def DeliverHints(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            Store.TombstoneSeconds = self.TombstoneSeconds
+            # a hint older than the tombstone expiry could bring back a deleted key
+            cutoff = time.time_ns() - self.TombstoneSeconds * 10**9
+            for node in list(self.hints):
+                hints = self.hints[node]
+                while hints:
+                    if any(change[1] < cutoff for change in hints[0]):
+                        hints.popleft()
+                        self.stats["hintsDropped"] += 1
+                        continue
+                    try:
+                        await self.Call(
+                            node, "/api/v1/replica/write", {"changes": hints[0]}
+                        )
+                    except Unreachable:
+                        # still down, try again next round
+                        break
+                    except RequestError as err:
+                        self.logger.error(f"hint dropped: {err}")
+                        self.stats["hintsDropped"] += 1
+                    else:
+                        self.stats["hintsSent"] += 1
+                    hints.popleft()
+                if not hints:
+                    del self.hints[node]
+
+    async def Authorized(self, request):
+        return await self.guard.TokenValidator(
+            self.settings.Config["Config"]["TokenConfig"]["secretKey"],
+            request.headers.get("X-Node-Token", ""),
+        )
+
+    async def ReplicaWrite(self, request):
+        if not await self.Authorized(request):
+            return web.json_response(
+                data={"status": 401, "Response": "bad node token"}, status=401
+            )
+        try:
+            payload = await request.json()
+            if not isinstance(payload, dict):
+                raise ValidationError("payload must be a JSON object")
+            changes = payload.get("changes")
+            if not isinstance(changes, list):
+                raise ValidationError("changes must be a list")
+            for change in changes:
+                if not (
+                    isinstance(change, list)
+                    and len(change) == 4
+                    and isinstance(change[0], str)
+                    and isinstance(change[1], int)
+                    and not isinstance(change[1], bool)
+                    and isinstance(change[3], bool)
+                ):
+                    raise ValidationError(f"bad change {change!r}")
+        except (ValueError, ValidationError) as err:
+            return web.json_response(
+                data={"status": 400, "Response": f"wrong payload: {err}"}, status=400
+            )
+        try:
+            seq = await Store.Apply(changes)
+        except ServerSide as err:
+            # answered as a server fault, the sender keeps a hint and retries
+            return web.json_response(
+                data={"status": 500, "Response": str(err)}, status=500
+            )
+        if seq is None:
+            # a newer write already won on this node, the sender must not count it
+            return web.json_response(
+                data={"status": 409, "Response": "older than the stored write"},
+                status=409,
+            )
+        return web.json_response(data={"status": 200, "Response": {"seq": seq}})
+
+    async def ReplicaRead(self, request):
+        if not await self.Authorized(request):
+            return web.json_response(
+                data={"status": 401, "Response": "bad node token"}, status=401
+            )
+        try:
+            payload = await request.json()
+            if not isinstance(payload, dict):
+                raise ValidationError("payload must be a JSON object")
+            keys, prefix = payload.get("keys"), payload.get("prefix", "")
+            if keys is not None and not (
+                isinstance(keys, list) and all(isinstance(key, str) for key in keys)
+            ):
+                raise ValidationError("keys must be a list of strings")
+            if not isinstance(prefix, str):
+                raise ValidationError("prefix must be a string")
+        except (ValueError, ValidationError) as err:
+            return web.json_response(
+                data={"status": 400, "Response": f"wrong payload: {err}"}, status=400
+            )
+        entries = Store.Stamped(keys=keys, prefix=prefix)
+        return web.json_response(data={"status": 200, "Response": entries})
+
+    async def Stats(self, request):
+        return web.json_response(
+            data={
+                "status": 200,
+                "Response": {
+                    **self.stats,
+                    "replicas": self.Replicas,
+                    "hintsQueued": {
+                        node: len(hints) for node, hints in self.hints.items()
+                    },
+                },
+            }
+        )
+
+    async def Start(self, app=None):
+        Store.TombstoneSeconds = self.TombstoneSeconds
+        self.session = aiohttp.ClientSession()
+        self.deliverer = asyncio.ensure_future(
+            self.DeliverHints(self.ReplicationCfg.get("HintInterval", 5))
+        )
+
+    async def Stop(self, app=None):
+        if self.deliverer is not None:
+            self.deliverer.cancel()
+            self.deliverer = None
+        for task in list(self.pending):
+            task.cancel()
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
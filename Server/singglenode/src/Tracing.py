@@ -0,0 +1,211 @@
+import io
+import math
+import time
+import pstats
+import asyncio
+import logging
+import cProfile
+import contextvars
+
+from aiohttp import web
+
+
+# per-request stage timings, None while tracing is off so `Stage` stays a no-op
+CurrentTrace = contextvars.ContextVar("CurrentTrace", default=None)
+# name of the stage the code is running in, nested stages are recorded under it
+CurrentStage = contextvars.ContextVar("CurrentStage", default=None)
+
+
+class RequestTrace:
+    __slots__ = ("stages", "closed")
+
+    def __init__(self):
+        self.stages = {}
+        # set once the request finished, background tasks then stop recording
+        self.closed = False
+
+
+class NoStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NoStageTimer = NoStage()
+
+
+class StageTimer:
+    __slots__ = ("trace", "name", "started", "token")
+
+    def __init__(self, trace: RequestTrace, name: str):
+        self.trace = trace
+        parent = CurrentStage.get()
+        self.name = name if parent is None else f"{parent}/{name}"
+
+    def __enter__(self):
+        self.token = CurrentStage.set(self.name)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        spent = time.perf_counter() - self.started
+        CurrentStage.reset(self.token)
+        if not self.trace.closed:
+            stages = self.trace.stages
+            stages[self.name] = stages.get(self.name, 0) + spent
+        return False
+
+
+def Stage(name: str):
+    """
+    Stage Function
+    --------------
+    Times a block of code as one stage of the current request. Outside a traced request
+    (or with tracing disabled) it returns a shared no-op context manager. A stage opened
+    inside another one is recorded as `outer/inner`, so its time is not counted twice.
+
+    Example:
+    --------
+    ```python
+    with Stage("request.json"):
+        data = await request.json()
+    ```
+    """
+    trace = CurrentTrace.get()
+    if trace is None or trace.closed:
+        return NoStageTimer
+    return StageTimer(trace, name)
+
+
+class Tracer:
+    """
+    The `Tracer` class shows where the time of a slow request goes. Its middleware opens a
+    trace for every request, the code under it records stages with `Stage`, and requests
+    slower than `Tracing.SlowRequestMs` are logged with a per-stage breakdown. It also
+    serves an admin endpoint that runs `cProfile` for a few seconds and returns the result.
+
+    Attributes:
+    ------------
+    - settings: The live `ConfigLoader`; the `Tracing` section can be changed by reload.
+    - guard: The `protection` instance used to check the admin token.
+    - profiling: True while a profile is being collected (only one at a time).
+
+    Methods:
+    ---------
+    - Tracing: Middleware that times the request and logs slow ones.
+    - Profile: Admin handler, `POST /api/v1/admin/profile?seconds=N`.
+
+    Notes:
+    ------
+    - With `Tracing.Enabled` false the middleware only reads the config and calls the
+      handler; every `Stage` is then a shared no-op.
+    - Nested stages show up as `outer/inner` and are left out of `other`. Replica calls
+      still running after the response was sent are not recorded.
+    - `Profile` needs a valid HMAC token (same secret as `TokenValidator`) in the
+      `X-Admin-Token` header, and `seconds` is capped by `Tracing.MaxProfileSeconds`.
+
+    Example:
+    --------
+    ```python
+    Trace = Tracer(Settings, protection())
+    app = web.Application(middlewares=[Trace.Tracing, Admission.Admission])
+    app.router.add_post("/api/v1/admin/profile", Trace.Profile)
+    ```
+    """
+
+    def __init__(self, settings, guard):
+        self.settings = settings
+        self.guard = guard
+        self.logger = logging.getLogger(__name__)
+        self.profiling = False
+
+    @property
+    def TracingCfg(self):
+        return self.settings.Config["Config"]["ServerConfig"].get("Tracing", {})
+
+    @web.middleware
+    async def Tracing(self, request, handler):
+        TracingCfg = self.TracingCfg
+        if not TracingCfg.get("Enabled", False) or request.path in TracingCfg.get(
+            "SkipPaths", ["/api/v1/watch", "/api/v1/admin/profile"]
+        ):
+            return await handler(request)
+
+        trace = RequestTrace()
+        token = CurrentTrace.set(trace)
+        started = time.perf_counter()
+        try:
+            return await handler(request)
+        finally:
+            total = time.perf_counter() - started
+            trace.closed = True
+            CurrentTrace.reset(token)
+            if total * 1000 >= TracingCfg.get("SlowRequestMs", 500):
+                stages = dict(trace.stages)
+                # nested stages are already inside their outer stage
+                outer = sum(spent for name, spent in stages.items() if "/" not in name)
+                stages["other"] = max(total - outer, 0)
+                breakdown = ", ".join(
+                    f"{name}={spent * 1000:.1f}ms"
+                    for name, spent in sorted(
+                        stages.items(), key=lambda item: item[1], reverse=True
+                    )
+                )
+                self.logger.warning(
+                    f"slow request {request.method} {request.path} "
+                    f"{total * 1000:.1f}ms: {breakdown}"
+                )
+
+    async def Profile(self, request):
+        TracingCfg = self.TracingCfg
+        if not await self.guard.TokenValidator(
+            self.settings.Config["Config"]["TokenConfig"]["secretKey"],
+            request.headers.get("X-Admin-Token", ""),
+        ):
+            return web.json_response(
+                data={"status": 401, "Response": "bad admin token"}, status=401
+            )
+        sort = request.query.get("sort", "cumulative")
+        try:
+            seconds = float(request.query.get("seconds", 10))
+            limit = int(request.query.get("limit", 50))
+        except ValueError:
+            return web.json_response(
+                data={"status": 400, "Response": "seconds and limit must be numbers"},
+                status=400,
+            )
+        if not math.isfinite(seconds):
+            # nan gets past the cap below and would sleep forever with the profiler on
+            return web.json_response(
+                data={"status": 400, "Response": "seconds must be a finite number"},
+                status=400,
+            )
+        if sort not in pstats.Stats.sort_arg_dict_default:
+            return web.json_response(
+                data={"status": 400, "Response": f"unknown sort key {sort!r}"},
+                status=400,
+            )
+        seconds = min(max(seconds, 0), TracingCfg.get("MaxProfileSeconds", 60))
+        if self.profiling:
+            return web.json_response(
+                data={"status": 409, "Response": "a profile is already running"},
+                status=409,
+            )
+
+        # the event loop runs every request on this thread, so this sees them all
+        profiler = cProfile.Profile()
+        self.profiling = True
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+            self.profiling = False
+
+        output = io.StringIO()
+        stats = pstats.Stats(profiler, stream=output)
+        stats.sort_stats(sort)
+        stats.print_stats(limit)
+        return web.Response(text=output.getvalue(), status=200)
@@ -1,9 +1,10 @@
 import json
+import asyncio
 import hmac
 import hashlib
 import time
 from datetime import datetime, timedelta
-from collections import defaultdict
+from collections import defaultdict, deque
 import logging
 
 import aiohttp
@@ -17,12 +18,17 @@ from erorr.erorr import (
     ValidationError,
     JsonError,
     TimeoutError,
+    NetworkError,
 )
+from src.JsonHandler import Store
+from src.ConfigHandler import ConfigLoader
+from src.Replication import Replicator
+from src.Tracing import Stage, Tracer
 
 
 ReqCounter = defaultdict(list)
-with open("config.json", "rb") as Cfg:
-    Config = json.load(Cfg)
+# live config, reloaded on SIGHUP or file change
+Settings = ConfigLoader("config.json")
 
 
 class Helper:
@@ -33,7 +39,7 @@ class Helper:
 
     Attributes:
     ------------
-    - config: Holds configuration settings (assumed from external `Config` class).
+    - config: The live configuration settings (from `Settings`, follows reloads).
     - logger: A logger instance used to log informational messages and errors.
 
     Methods:
@@ -76,9 +82,15 @@ class Helper:
 
     """
 
+    @property
+    def config(self):
+        return Settings.Config
+
+    @property
+    def LogActivity(self):
+        return self.config["Config"]["ServerConfig"]["LogActivity"]
+
     def __init__(self):
-        self.config = Config
-        self.LogActivity = self.config["Config"]["ServerConfig"]["LogActivity"]
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(logging.INFO)
 
@@ -183,6 +195,10 @@ class Helper:
         - Catches `ServerSide` exceptions, logs the error, and returns a generic 500 error response
           if a server-side issue occurs.
         """
+        with Stage("ReturnBack"):
+            return self.BuildResponse(Message, status, isjson)
+
+    def BuildResponse(self, Message, status: int, isjson: bool):
         try:
             if isjson:
                 # Log the status and return a JSON response
@@ -206,25 +222,176 @@ class Helper:
 class RequestHandler:
     """Recive Request Handler"""
 
-    def __init__(self):
-        self.config = Config
-        self.LogActivity = self.config["Config"]["ServerConfig"]["LogActivity"]
+    @property
+    def config(self):
+        return Settings.Config
+
+    @property
+    def LogActivity(self):
+        return self.config["Config"]["ServerConfig"]["LogActivity"]
 
     # make recive json then process it in other files python
     async def Recive(self, request):
         try:
-            data = await request.json()
-            return await Helper().ReturnBack(
-                Message={"data": data}, status=200, isjson=True
-            )
+            with Stage("request.json"):
+                data = await request.json() if request.can_read_body else {}
         except Exception as err:
             return await Helper().ReturnBack(
                 Message="did you add the payload?",
                 status=400,
                 isjson=True,
-                method="GET",
             )
+
+        level = request.headers.get("X-Consistency")
+        try:
+            self.CheckPayload(request.method, data)
+            if request.method == "POST":
+                with Stage("replication"):
+                    seq = await Cluster.Write(items=data, level=level)
+                return await Helper().ReturnBack(
+                    Message={"seq": seq}, status=200, isjson=True
+                )
+            if request.method == "DELETE":
+                with Stage("replication"):
+                    seq = await Cluster.Write(deletes=data["keys"], level=level)
+                return await Helper().ReturnBack(
+                    Message={"seq": seq}, status=200, isjson=True
+                )
+            # each replica answers from one snapshot, so multi-key reads stay consistent
+            with Stage("replication"):
+                data = await Cluster.Read(
+                    keys=data.get("keys"), prefix=data.get("prefix", ""), level=level
+                )
+            return await Helper().ReturnBack(
+                Message={"data": data}, status=200, isjson=True
+            )
+        except NetworkError as err:
+            return await Helper().ReturnBack(
+                Message=f"not enough replicas: {err}", status=503, isjson=True
+            )
+        except ServerSide as err:
+            await Helper().LoggingErorr(message=str(err), status="error")
+            return await Helper().ReturnBack(
+                Message="could not store the write", status=500, isjson=True
+            )
+        except (JsonError, ValidationError) as err:
+            return await Helper().ReturnBack(
+                Message=f"wrong payload: {err}", status=400, isjson=True
+            )
+
+    def CheckPayload(self, method: str, data):
+        """Raise `ValidationError` unless `data` has the shape `method` expects."""
+        if not isinstance(data, dict):
+            raise ValidationError("payload must be a JSON object")
+        if method == "POST":
             return
+        keys = data.get("keys")
+        if method == "DELETE" and keys is None:
+            raise ValidationError("keys is required")
+        if keys is not None and not (
+            isinstance(keys, list) and all(isinstance(key, str) for key in keys)
+        ):
+            raise ValidationError("keys must be a list of strings")
+        if not isinstance(data.get("prefix", ""), str):
+            raise ValidationError("prefix must be a string")
+
+    async def Watch(self, request):
+        """
+        Watch Method
+        ------------
+        Streams change events (put/delete with sequence numbers) from the write log, so
+        integrators don't have to poll `/api/v1/get`. Served over WebSocket when the client
+        asks for an upgrade, otherwise as Server-Sent Events.
+
+        Parameters:
+        -----------
+        - prefix (query): Only keys starting with this prefix are sent. Default is all keys.
+        - since (query): Resume after this sequence number; SSE clients may send the
+                         `Last-Event-ID` header instead.
+
+        Returns:
+        --------
+        - 400 if `since` is not a number, 410 if it is older than the retained log,
+          503 when `Watch.MaxSubscribers` streams are already open.
+        - Otherwise a stream of `{"seq", "op", "key", "value"}` events. A subscriber that
+          reads too slowly gets a final `{"dropped": true}` event and is disconnected.
+
+        Notes:
+        ------
+        - Every `Watch.KeepAliveSeconds` an idle stream sends a WebSocket ping or an SSE
+          comment, so a client that went away is noticed and its subscriber removed.
+        """
+        WatchCfg = self.config["Config"]["ServerConfig"].get("Watch", {})
+        KeepAlive = WatchCfg.get("KeepAliveSeconds", 15)
+        prefix = request.query.get("prefix", "")
+        since = request.query.get("since", request.headers.get("Last-Event-ID"))
+        try:
+            since = int(since) if since is not None else None
+        except ValueError:
+            return await Helper().ReturnBack(
+                Message="since must be a sequence number", status=400, isjson=True
+            )
+        if len(Store.feed.subscribers) >= WatchCfg.get("MaxSubscribers", 1000):
+            return await Helper().ReturnBack(
+                Message="too many watchers, try again later", status=503, isjson=True
+            )
+        try:
+            sub = Store.Watch(prefix=prefix, since=since)
+        except ValidationError as err:
+            return await Helper().ReturnBack(Message=str(err), status=410, isjson=True)
+
+        try:
+            if request.headers.get("Upgrade", "").lower() == "websocket":
+                stream = web.WebSocketResponse(heartbeat=KeepAlive)
+                await stream.prepare(request)
+                sender = asyncio.ensure_future(self.SendEvents(stream, sub))
+                try:
+                    # reading is what notices a close frame or a missed heartbeat pong
+                    async for message in stream:
+                        pass
+                finally:
+                    sender.cancel()
+                return stream
+
+            stream = web.StreamResponse(
+                headers={
+                    "Content-Type": "text/event-stream",
+                    "Cache-Control": "no-cache",
+                }
+            )
+            await stream.prepare(request)
+            while True:
+                try:
+                    event = await asyncio.wait_for(sub.Next(), KeepAlive)
+                except asyncio.TimeoutError:
+                    # writing to a client that went away fails and ends the stream
+                    await stream.write(b": keep-alive\n\n")
+                    continue
+                if event is None:
+                    await stream.write(b'event: dropped\ndata: {"dropped": true}\n\n')
+                    break
+                await stream.write(
+                    f"id: {event['seq']}\ndata: {json.dumps(event)}\n\n".encode()
+                )
+            return stream
+        except ConnectionResetError:
+            # the client went away
+            return stream
+        finally:
+            sub.Close()
+
+    async def SendEvents(self, stream, sub):
+        """Push feed events to a WebSocket until the subscriber is dropped."""
+        try:
+            while True:
+                event = await sub.Next()
+                await stream.send_json(event or {"dropped": True})
+                if event is None:
+                    break
+            await stream.close()
+        except ConnectionResetError:
+            # the receive loop in `Watch` sees the close and cleans up
+            pass
 
     async def PingPong(self, request):
         return await Helper().ReturnBack(Message="Pong", status=200, isjson=True)
@@ -248,9 +415,13 @@ class protection:
     and `TokenValidator` methods for secure API authentication based on a rotating HMAC token.
     """
 
-    def __init__(self):
-        self.config = Config
-        self.LogActivity = self.config["Config"]["ServerConfig"]["LogActivity"]
+    @property
+    def config(self):
+        return Settings.Config
+
+    @property
+    def LogActivity(self):
+        return self.config["Config"]["ServerConfig"]["LogActivity"]
 
     @web.middleware
     async def RateLimiter(self, request, handler):
@@ -258,7 +429,8 @@ class protection:
         RateLimiter Method
         ------------------
         A middleware function to implement rate limiting based on the client's IP address.
-        Limits the number of requests an IP can make within a given time frame (10 seconds) to 20 requests.
+        Limits the number of requests an IP can make within a given time frame (`RateLimit.WindowSeconds`,
+        default 20 seconds) to `RateLimit.MaxRequests` (default 20) requests.
 
         Parameters:
         -----------
@@ -273,8 +445,12 @@ class protection:
 
         Notes:
         ------
-        - The limit is set to 20 requests per 10 seconds for each client IP address.
-        - All requests from an IP are tracked in a dictionary and filtered by the last 10-second window.
+        - The limit and window are read from the live config, so a reload changes them immediately.
+        - The whitelist is checked against the compiled `IpTrie`, which accepts exact IPs and
+          IPv4/IPv6 CIDR ranges.
+        - All requests from an IP are tracked in a dictionary and filtered by the last window.
+        - Replica calls (`/api/v1/replica/*`) with a valid `X-Node-Token` still need to pass
+          the whitelist but are not rate limited.
         - Can be adjusted to throttle different endpoints or impose stricter limits as needed.
 
         Example:
@@ -284,30 +460,51 @@ class protection:
         ```
         """
 
+        with Stage("RateLimiter"):
+            rejected = await self.CheckRequest(request)
+        if rejected is not None:
+            return rejected
+
+        # Process the request
+        return await handler(request)
+
+    async def CheckRequest(self, request):
+        """Whitelist and rate-limit checks of `RateLimiter`; returns a rejection or None."""
         IpAddr = request.remote
         TimeNow = datetime.now()
+        # one consistent config for the whole request, even if a reload lands meanwhile
+        config, whitelist = Settings.State
+        ServerConfig = config["Config"]["ServerConfig"]
 
-        if self.config["Config"]["ServerConfig"]["WhitelistIP"]["UseWhitelist"]:
-            if (
-                IpAddr
-                not in self.config["Config"]["ServerConfig"]["WhitelistIP"][
-                    "IpAllowLst"
-                ]
-            ):
+        if ServerConfig["WhitelistIP"]["UseWhitelist"]:
+            if not whitelist.Contains(IpAddr):
                 return await Helper().ReturnBack(
                     Message="who are you?, i dont see in the whitelist",
                     status=400,
                     isjson=False,
                 )
 
-        # Remove entries older than 20 seconds
+        if not ServerConfig.get("ratelimiter", True):
+            return None
+
+        # node-to-node calls come one per client request, don't count them per IP
+        if request.path.startswith("/api/v1/replica/") and self.CheckToken(
+            config["Config"]["TokenConfig"]["secretKey"],
+            request.headers.get("X-Node-Token", ""),
+        ):
+            return None
+
+        RateLimit = ServerConfig.get("RateLimit", {})
+        window = RateLimit.get("WindowSeconds", 20)
+
+        # Remove entries older than the window
         ReqCounter[IpAddr] = [
-            t for t in ReqCounter[IpAddr] if t > TimeNow - timedelta(seconds=20)
+            t for t in ReqCounter[IpAddr] if t > TimeNow - timedelta(seconds=window)
         ]
 
         request_count = len(ReqCounter[IpAddr])
 
-        if request_count >= 20:
+        if request_count >= RateLimit.get("MaxRequests", 20):
             return web.Response(
                 text="Your IP has been blocked due to too many requests.",
                 status=429,
@@ -315,16 +512,15 @@ class protection:
 
         # Add current request timestamp
         ReqCounter[IpAddr].append(TimeNow)
-
-        # Process the request
-        return await handler(request)
+        return None
 
     async def TokenHandler(self, key: str):
         """
         TokenHandler Method
         -------------------
         Generates a secure time-based HMAC (Hash-based Message Authentication Code) token using
-        the given `key`. The token changes every 10 seconds to ensure short-term validity.
+        the given `key`. The token changes every `TokenConfig.duration` seconds, the same window
+        `TokenValidator` checks against.
 
         Parameters:
         -----------
@@ -332,7 +528,7 @@ class protection:
 
         Returns:
         --------
-        - str: A secure HMAC token generated using the current time divided by 10 (rotating every 10 seconds).
+        - str: A secure HMAC token generated using the current time divided by the token duration.
 
         Example:
         --------
@@ -340,9 +536,9 @@ class protection:
         token = await protection().TokenHandler("my_secret_key")
         ```
         """
-        timenow = int(time.time() // 10)
+        timenow = int(time.time() // self.config["Config"]["TokenConfig"]["duration"])
         return hmac.new(
-            key.encode(), str(timenow).encode(), hashlib.sha256()
+            key.encode(), str(timenow).encode(), hashlib.sha256
         ).hexdigest()
 
     async def TokenValidator(self, key: str, ClientToken: str):
@@ -376,11 +572,218 @@ class protection:
         - The validation checks both the current token and the previous one to account for slight delays.
         - This ensures token security while allowing minor time discrepancies between client and server.
         """
+        with Stage("TokenValidator"):
+            return self.CheckToken(key, ClientToken)
+
+    def CheckToken(self, key: str, ClientToken: str):
         timenow = int(time.time() // self.config["Config"]["TokenConfig"]["duration"])
         PalidToken = hmac.new(
-            key.encode(), str(timenow).encode(), hashlib.sha256()
+            key.encode(), str(timenow).encode(), hashlib.sha256
         ).hexdigest()
         PerviousToken = hmac.new(
-            key.encode(), str(timenow - 1).encode(), hashlib.sha256()
+            key.encode(), str(timenow - 1).encode(), hashlib.sha256
         ).hexdigest()
         return ClientToken == PalidToken or ClientToken == PerviousToken
+
+
+class AdmissionControl:
+    """
+    The `AdmissionControl` class protects the node from overload with a global limit on
+    concurrent requests, a bounded wait queue and a deadline for every request. Unlike
+    `protection.RateLimiter`, it works across all clients, so it also holds up against
+    many distributed callers.
+
+    Attributes:
+    ------------
+    - MaxConcurrent: How many requests may run handlers at the same time.
+    - MaxQueue: How many requests may wait for a free slot before new ones are shed.
+    - MaxPriorityQueue: The same bound for priority requests, kept apart from `MaxQueue`.
+    - Deadline: Default time budget (seconds) for a request; clients may lower it with
+                the `X-Request-Deadline` header.
+    - PriorityPaths: Paths (health, heartbeat) that are admitted ahead of normal traffic.
+    - stats: Counters reported by the `Stats` endpoint.
+
+    Methods:
+    ---------
+    - Admission: Middleware that queues, admits or sheds each request.
+    - Stats: Handler returning in-flight count, queue depth and shed counts.
+
+    Notes:
+    ------
+    - A request is shed early with 503 + Retry-After when the queue is full or when the
+      expected wait already exceeds its deadline, instead of timing out later.
+    - Long-lived requests (`StreamPaths`: `/api/v1/watch`, the admin profiler) are not
+      queued or timed.
+    - Priority requests skip the deadline-based shedding and are woken before normal
+      ones whenever a slot frees up. Their own queue is bounded by `MaxPriorityQueue`,
+      so a flood of health checks can't starve normal traffic.
+    - Runs after `protection.RateLimiter`, so requests from IPs that aren't allowed
+      never take a place in the queue.
+
+    Example:
+    --------
+    ```python
+    Admission = AdmissionControl()
+    app = web.Application(middlewares=[protection().RateLimiter, Admission.Admission])
+    ```
+    """
+
+    def __init__(self):
+        self.InFlight = 0
+        self.Waiting = {True: deque(), False: deque()}
+        # moving average of handler time, used to predict the queue wait
+        self.AvgService = 0.01
+        self.stats = {"admitted": 0, "shed": 0, "timedOut": 0}
+
+    @property
+    def AdmissionCfg(self):
+        return Settings.Config["Config"]["ServerConfig"].get("Admission", {})
+
+    @property
+    def MaxConcurrent(self):
+        return self.AdmissionCfg.get("MaxConcurrent", 64)
+
+    @property
+    def MaxQueue(self):
+        return self.AdmissionCfg.get("MaxQueue", 128)
+
+    @property
+    def MaxPriorityQueue(self):
+        return self.AdmissionCfg.get("MaxPriorityQueue", 16)
+
+    @property
+    def Deadline(self):
+        return self.AdmissionCfg.get("DeadlineSeconds", 5)
+
+    @property
+    def StreamPaths(self):
+        return self.AdmissionCfg.get(
+            "StreamPaths", ["/api/v1/watch", "/api/v1/admin/profile"]
+        )
+
+    @property
+    def PriorityPaths(self):
+        return self.AdmissionCfg.get("PriorityPaths", ["/api/v1/ceknode/Ping"])
+
+    def QueueDepth(self):
+        return len(self.Waiting[True]) + len(self.Waiting[False])
+
+    def Shed(self, reason: str, RetryAfter: float):
+        self.stats["shed"] += 1
+        return web.json_response(
+            data={"status": 503, "Response": reason},
+            status=503,
+            headers={"Retry-After": str(max(1, round(RetryAfter)))},
+        )
+
+    async def Acquire(self, priority: bool, deadline: float):
+        if self.InFlight < self.MaxConcurrent and not self.QueueDepth():
+            self.InFlight += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.Waiting[priority].append(waiter)
+        try:
+            await asyncio.wait_for(waiter, max(deadline - time.monotonic(), 0))
+        except BaseException as err:
+            # Release may have handed us the slot just before the timeout/cancel hit
+            if waiter.done() and not waiter.cancelled():
+                self.Release()
+            if isinstance(err, asyncio.TimeoutError):
+                raise TimeoutError("deadline passed while waiting in the queue")
+            raise
+        finally:
+            if waiter in self.Waiting[priority]:
+                self.Waiting[priority].remove(waiter)
+        # the slot was handed over by Release, so InFlight already counts us
+
+    def Release(self):
+        # after a reload lowered MaxConcurrent, let the surplus slots drain first
+        if self.InFlight > self.MaxConcurrent:
+            self.InFlight -= 1
+            return
+        for priority in (True, False):
+            while self.Waiting[priority]:
+                waiter = self.Waiting[priority].popleft()
+                if not waiter.done():
+                    # hand the slot straight to the next waiter
+                    waiter.set_result(None)
+                    return
+        self.InFlight -= 1
+
+    @web.middleware
+    async def Admission(self, request, handler):
+        # long-lived streams would hold a slot and hit the deadline, so skip admission
+        if request.path in self.StreamPaths:
+            return await handler(request)
+
+        priority = request.path in self.PriorityPaths
+        budget = self.Deadline
+        try:
+            budget = min(budget, float(request.headers["X-Request-Deadline"]))
+        except (KeyError, ValueError):
+            pass
+        deadline = time.monotonic() + budget
+
+        if priority:
+            if len(self.Waiting[True]) >= self.MaxPriorityQueue:
+                return self.Shed(
+                    "server is overloaded, priority queue is full", self.AvgService
+                )
+        else:
+            ExpectedWait = 0
+            if self.InFlight >= self.MaxConcurrent:
+                ExpectedWait = (
+                    (self.QueueDepth() + 1) * self.AvgService / self.MaxConcurrent
+                )
+            if len(self.Waiting[False]) >= self.MaxQueue:
+                return self.Shed("server is overloaded, queue is full", ExpectedWait)
+            if ExpectedWait + self.AvgService > budget:
+                return self.Shed(
+                    "server is overloaded, request cannot finish in time",
+                    ExpectedWait,
+                )
+
+        try:
+            with Stage("admission"):
+                await self.Acquire(priority, deadline)
+        except TimeoutError as err:
+            self.stats["timedOut"] += 1
+            return self.Shed(str(err), budget)
+
+        self.stats["admitted"] += 1
+        started = time.monotonic()
+        try:
+            return await asyncio.wait_for(
+                handler(request), max(deadline - started, 0)
+            )
+        except asyncio.TimeoutError:
+            self.stats["timedOut"] += 1
+            return self.Shed("deadline passed while handling the request", budget)
+        finally:
+            self.AvgService = 0.9 * self.AvgService + 0.1 * (
+                time.monotonic() - started
+            )
+            self.Release()
+
+    async def Stats(self, request):
+        return await Helper().ReturnBack(
+            Message={
+                "inFlight": self.InFlight,
+                "queueDepth": self.QueueDepth(),
+                "maxConcurrent": self.MaxConcurrent,
+                "maxQueue": self.MaxQueue,
+                "maxPriorityQueue": self.MaxPriorityQueue,
+                "avgServiceSeconds": round(self.AvgService, 6),
+                **self.stats,
+            },
+            status=200,
+            isjson=True,
+        )
+
+
+# coordinates reads/writes with the other nodes (single node when none configured)
+Cluster = Replicator(Settings, protection())
+
+# per-stage request timings and the admin profiler
+Trace = Tracer(Settings, protection())
@@ -0,0 +1,86 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+from src.server import AdmissionControl
+
+
+def test_handed_over_slot_is_returned_when_waiter_is_cancelled():
+    async def scenario():
+        admission = AdmissionControl()
+        for _ in range(admission.MaxConcurrent):
+            await admission.Acquire(False, asyncio.get_running_loop().time() + 60)
+        waiting = asyncio.ensure_future(admission.Acquire(False, 1e12))
+        await asyncio.sleep(0)
+        assert admission.QueueDepth() == 1
+        # hand the slot over and cancel the waiter before it gets to run
+        admission.Release()
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        if not waiting.cancelled():
+            # older wait_for swallows the cancel and keeps the slot, give it back
+            admission.Release()
+        assert admission.InFlight == admission.MaxConcurrent - 1
+        assert admission.QueueDepth() == 0
+
+    asyncio.run(scenario())
+
+
+def test_release_wakes_priority_waiters_first():
+    async def scenario():
+        admission = AdmissionControl()
+        for _ in range(admission.MaxConcurrent):
+            await admission.Acquire(False, 1e12)
+        order = []
+
+        async def Wait(priority):
+            await admission.Acquire(priority, 1e12)
+            order.append(priority)
+
+        normal = asyncio.ensure_future(Wait(False))
+        urgent = asyncio.ensure_future(Wait(True))
+        await asyncio.sleep(0)
+        admission.Release()
+        admission.Release()
+        await asyncio.gather(normal, urgent)
+        assert order == [True, False]
+        assert admission.InFlight == admission.MaxConcurrent
+
+    asyncio.run(scenario())
+
+
+def test_priority_queue_is_bounded():
+    async def Handler(request):
+        return web.Response(text="pong")
+
+    async def scenario():
+        admission = AdmissionControl()
+        for _ in range(admission.MaxConcurrent):
+            await admission.Acquire(False, 1e12)
+        pings = [
+            asyncio.ensure_future(
+                admission.Admission(
+                    make_mocked_request("GET", admission.PriorityPaths[0]), Handler
+                )
+            )
+            for _ in range(admission.MaxPriorityQueue + 10)
+        ]
+        await asyncio.sleep(0)
+        assert len(admission.Waiting[True]) == admission.MaxPriorityQueue
+        shed = [ping.result().status for ping in pings if ping.done()]
+        assert shed == [503] * 10
+        for ping in pings:
+            ping.cancel()
+        await asyncio.gather(*pings, return_exceptions=True)
+
+    asyncio.run(scenario())
+
+
+def test_rate_limiter_runs_before_admission():
+    import main
+
+    middlewares = list(main.app.middlewares)
+    assert middlewares.index(main.ProtectionServer.RateLimiter) < middlewares.index(
+        main.Admission.Admission
+    )
@@ -0,0 +1,93 @@
+import json
+import asyncio
+
+import pytest
+
+from erorr.erorr import ValidationError
+from src.ConfigHandler import ConfigLoader, IpTrie
+
+
+def test_iptrie_exact_and_cidr_lookups():
+    trie = IpTrie(["192.168.100.0/24", "10.0.0.7", "2001:db8::/32", "::1"])
+    assert trie.Contains("192.168.100.14")
+    assert not trie.Contains("192.168.101.1")
+    assert trie.Contains("10.0.0.7")
+    assert not trie.Contains("10.0.0.8")
+    assert trie.Contains("2001:db8:abcd::1")
+    assert not trie.Contains("2001:db9::1")
+    assert trie.Contains("::1")
+    assert not trie.Contains("not-an-ip")
+
+
+def test_iptrie_ipv4_mapped_entries_and_clients():
+    trie = IpTrie(["::ffff:10.1.0.0/112", "172.16.0.1"])
+    assert trie.Contains("10.1.2.3")
+    assert trie.Contains("::ffff:10.1.2.3")
+    assert trie.Contains("::ffff:172.16.0.1")
+    assert not trie.Contains("10.2.0.1")
+
+
+def test_iptrie_rejects_bad_entries():
+    with pytest.raises(ValidationError):
+        IpTrie(["300.1.1.1"])
+
+
+def WriteConfig(tmp_path, edit):
+    with open("config.json") as infile:
+        config = json.load(infile)
+    edit(config["Config"]["ServerConfig"])
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps(config))
+    return str(path)
+
+
+@pytest.mark.parametrize(
+    "edit",
+    [
+        lambda cfg: cfg["WhitelistIP"].pop("UseWhitelist"),
+        lambda cfg: cfg.update(RateLimit=5),
+        lambda cfg: cfg.update(Admission=[]),
+        lambda cfg: cfg["Replication"].update(Collections={"user:": "ALL"}),
+        lambda cfg: cfg["RateLimit"].update(MaxRequests=True),
+        lambda cfg: cfg["Replication"].update(ReadConsistency="MOST"),
+        lambda cfg: cfg["pool"].update(NodeIp="1.1.1.1"),
+    ],
+)
+def test_invalid_config_is_rejected(tmp_path, edit):
+    with pytest.raises(ValidationError):
+        ConfigLoader(WriteConfig(tmp_path, edit))
+
+
+def test_reload_keeps_old_config_and_watcher_survives(tmp_path):
+    path = WriteConfig(tmp_path, lambda cfg: None)
+    loader = ConfigLoader(path)
+
+    async def scenario():
+        watcher = asyncio.ensure_future(loader.Watch(0.01))
+        # a bug inside Reload must not end the watcher
+        original, loader.Reload = loader.Reload, lambda: {}["boom"]
+        with open(path, "a") as outfile:
+            outfile.write(" ")
+        await asyncio.sleep(0.05)
+        assert not watcher.done()
+        loader.Reload = original
+        with open(path, "w") as outfile:
+            outfile.write('{"Config": {"ServerConfig": {"RateLimit": 5}}}')
+        await asyncio.sleep(0.05)
+        assert not watcher.done()
+        watcher.cancel()
+
+    asyncio.run(scenario())
+    assert loader.Config["Config"]["ServerConfig"]["LogActivity"] is False
+
+
+@pytest.mark.parametrize("text", ["[1, 2]", '"config"', "null"])
+def test_non_object_config_is_rejected(tmp_path, text):
+    path = WriteConfig(tmp_path, lambda cfg: None)
+    loader = ConfigLoader(path)
+    with open(path, "w") as outfile:
+        outfile.write(text)
+    assert loader.Reload() is False
+    assert loader.Config["Config"]["ServerConfig"]["LogActivity"] is False
+    with pytest.raises(ValidationError):
+        ConfigLoader(path)
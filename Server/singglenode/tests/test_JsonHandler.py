@@ -0,0 +1,137 @@
+import json
+import time
+import asyncio
+
+import pytest
+
+from erorr.erorr import ValidationError
+from src.JsonHandler import VersionStore
+
+
+def test_snapshot_isolated_from_later_commits(tmp_path):
+    async def scenario():
+        store = VersionStore(str(tmp_path / "output.json"))
+        await store.Put({"a": 1, "b": 2})
+        with store.Snapshot() as snap:
+            await store.Put({"a": 10, "c": 3})
+            await store.Delete(["b"])
+            assert snap.Scan() == {"a": 1, "b": 2}
+            assert snap.GetMany(["a", "c"]) == {"a": 1, "c": None}
+        with store.Snapshot() as snap:
+            assert snap.Scan() == {"a": 10, "c": 3}
+
+    asyncio.run(scenario())
+
+
+def test_versions_collected_after_release(tmp_path):
+    async def scenario():
+        store = VersionStore(str(tmp_path / "output.json"))
+        await store.Put({"a": 1, "b": 2})
+        snap = store.Snapshot()
+        await store.Put({"a": 2})
+        await store.Delete(["b"])
+        # the open snapshot still needs the old versions
+        assert len(store.versions["a"]) == 2
+        assert len(store.versions["b"]) == 2
+        snap.Release()
+        assert store.versions["a"] == [(2, 2)]
+        assert "b" not in store.versions
+        assert not store.touched
+
+    asyncio.run(scenario())
+
+
+def test_write_returns_after_file_is_swapped_in(tmp_path):
+    path = tmp_path / "output.json"
+
+    async def scenario():
+        store = VersionStore(str(path))
+        await asyncio.gather(*(store.Put({f"k{i}": i}) for i in range(20)))
+        assert store.persisted == store.seq
+        assert json.loads(path.read_text()) == {f"k{i}": i for i in range(20)}
+        assert not (tmp_path / "output.json.tmp").exists()
+
+    asyncio.run(scenario())
+    assert VersionStore(str(path)).Snapshot().Scan() == {f"k{i}": i for i in range(20)}
+
+
+def test_stamped_writes_keep_the_newest(tmp_path):
+    async def scenario():
+        store = VersionStore(str(tmp_path / "output.json"))
+        await store.Put({"a": "new"}, stamp=20)
+        await store.Put({"a": "old"}, stamp=10)
+        await store.Delete(["a"], stamp=5)
+        assert store.Stamped(keys=["a"]) == {"a": [20, "new", False]}
+
+    asyncio.run(scenario())
+
+
+def test_apply_reports_rejected_changes(tmp_path):
+    async def scenario():
+        store = VersionStore(str(tmp_path / "output.json"))
+        assert await store.Apply([["k", 100, 1, False]]) == 1
+        assert await store.Apply([["k", 100, 2, False]]) is None
+        assert await store.Apply([["k", 50, 3, False]]) is None
+        assert store.Stamped(keys=["k"]) == {"k": [100, 1, False]}
+
+    asyncio.run(scenario())
+
+
+def test_next_stamp_stays_above_every_stamp_seen(tmp_path):
+    async def scenario():
+        store = VersionStore(str(tmp_path / "output.json"))
+        # a replica whose clock runs an hour ahead
+        ahead = time.time_ns() + 3600 * 10**9
+        await store.Apply([["k", ahead, 1, False]])
+        stamp = store.NextStamp()
+        assert stamp > ahead
+        assert store.NextStamp() > stamp
+        assert await store.Apply([["k", stamp, 2, False]]) is not None
+
+    asyncio.run(scenario())
+
+
+def test_tombstone_stamps_expire(tmp_path):
+    async def scenario():
+        store = VersionStore(str(tmp_path / "output.json"))
+        store.TombstoneSeconds = 60
+        now = time.time_ns()
+        await store.Put({"a": 1, "b": 2}, stamp=now - 120 * 10**9)
+        await store.Delete(["a"], stamp=now - 90 * 10**9)
+        await store.Delete(["b"], stamp=now)
+        # the expired stamp goes on the next apply, the recent one stays
+        assert "a" not in store.stamps
+        assert store.stamps["b"] == now
+
+    asyncio.run(scenario())
+
+
+def test_resume_rejected_when_commit_partly_trimmed(tmp_path):
+    async def scenario():
+        store = VersionStore(str(tmp_path / "output.json"))
+        store.feed.LogSize = 3
+        await store.Put({"a": 1, "b": 2})
+        await store.Put({"c": 3, "d": 4})
+        with pytest.raises(ValidationError):
+            store.Watch(since=0)
+        sub = store.Watch(since=1)
+        assert [await sub.Next() for _ in range(2)] == [
+            {"seq": 2, "op": "put", "key": "c", "value": 3},
+            {"seq": 2, "op": "put", "key": "d", "value": 4},
+        ]
+        sub.Close()
+
+    asyncio.run(scenario())
+
+
+def test_slow_subscriber_is_dropped(tmp_path):
+    async def scenario():
+        store = VersionStore(str(tmp_path / "output.json"))
+        store.feed.QueueSize = 1
+        sub = store.Watch(prefix="user:")
+        await store.Put({"user:1": 1, "other": 0})
+        await store.Put({"user:2": 2})
+        assert await sub.Next() is None
+        assert not store.feed.subscribers
+
+    asyncio.run(scenario())
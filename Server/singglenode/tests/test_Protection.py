@@ -0,0 +1,54 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+from src.server import protection, Settings, ReqCounter
+
+
+def Secret():
+    return Settings.Config["Config"]["TokenConfig"]["secretKey"]
+
+
+def test_token_handler_output_passes_validator():
+    async def scenario():
+        guard = protection()
+        token = await guard.TokenHandler(Secret())
+        assert await guard.TokenValidator(Secret(), token)
+        assert not await guard.TokenValidator(Secret(), "forged")
+
+    asyncio.run(scenario())
+
+
+def test_replica_calls_with_node_token_skip_the_ip_limit():
+    async def Handler(request):
+        return web.Response(text="ok")
+
+    async def scenario():
+        guard = protection()
+        token = await guard.TokenHandler(Secret())
+        WhitelistIP = Settings.Config["Config"]["ServerConfig"]["WhitelistIP"]
+        UseWhitelist, WhitelistIP["UseWhitelist"] = WhitelistIP["UseWhitelist"], False
+        ReqCounter.clear()
+        try:
+            statuses = []
+            for _ in range(30):
+                request = make_mocked_request(
+                    "POST", "/api/v1/replica/write", headers={"X-Node-Token": token}
+                )
+                statuses.append((await guard.RateLimiter(request, Handler)).status)
+            assert statuses == [200] * 30
+            unsigned = [
+                (
+                    await guard.RateLimiter(
+                        make_mocked_request("POST", "/api/v1/replica/write"), Handler
+                    )
+                ).status
+                for _ in range(30)
+            ]
+            assert 429 in unsigned
+        finally:
+            WhitelistIP["UseWhitelist"] = UseWhitelist
+            ReqCounter.clear()
+
+    asyncio.run(scenario())
@@ -0,0 +1,216 @@
+import time
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from erorr.erorr import ServerSide, RequestError, NetworkError, ValidationError
+from src import Replication
+from src.JsonHandler import VersionStore
+from src.server import Cluster, RequestHandler
+
+
+def test_rejected_hints_dropped_unreachable_kept():
+    async def scenario():
+        answers = {
+            "http://rejects": RequestError("400"),
+            "http://down": NetworkError("503"),
+        }
+
+        async def Call(node, path, payload):
+            raise answers[node]
+
+        Cluster.Call = Call
+        Cluster.hints.clear()
+        stamp = time.time_ns()
+        Cluster.hints["http://rejects"].append([["a", stamp, 1, False]])
+        Cluster.hints["http://down"].append([["a", stamp, 1, False]])
+        Cluster.hints["http://down"].append([["b", stamp - 10**18, 1, False]])
+        Cluster.hints["http://down"].rotate()
+        delivery = asyncio.ensure_future(Cluster.DeliverHints(0))
+        await asyncio.sleep(0.01)
+        delivery.cancel()
+        # rejected and too old hints are dropped, the down node keeps its hint
+        assert "http://rejects" not in Cluster.hints
+        assert [hint[0][0] for hint in Cluster.hints["http://down"]] == ["a"]
+        assert Cluster.stats["hintsDropped"] == 2
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        del Cluster.Call
+        Cluster.hints.clear()
+        Cluster.stats["hintsDropped"] = 0
+
+
+def test_write_rejected_locally_is_not_an_ack(tmp_path, monkeypatch):
+    store = VersionStore(str(tmp_path / "output.json"))
+    monkeypatch.setattr(Replication, "Store", store)
+
+    async def scenario():
+        # a newer write for "k" already won here, without the stamp being seen
+        store.stamps["k"] = time.time_ns() + 3600 * 10**9
+        with pytest.raises(NetworkError):
+            await Cluster.Write({"k": 1}, level="ONE")
+        assert store.Stamped(keys=["k"])["k"][1] is None
+
+    asyncio.run(scenario())
+
+
+def test_local_disk_failure_still_reaches_write_level(tmp_path, monkeypatch):
+    store = VersionStore(str(tmp_path / "missing" / "output.json"))
+    monkeypatch.setattr(Replication, "Store", store)
+    nodes = ["http://b", "http://c"]
+    monkeypatch.setattr(Replication.Replicator, "Replicas", property(lambda _: nodes))
+
+    async def Call(node, path, payload):
+        return {"seq": 1}
+
+    monkeypatch.setattr(Cluster, "Call", Call)
+
+    async def scenario():
+        # two of three replicas is a quorum even though the local write failed
+        await Cluster.Write({"k": 1}, level="QUORUM")
+        with pytest.raises(ServerSide):
+            await Cluster.Write({"k": 2}, level="ALL")
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize(
+    "path, payload",
+    [
+        ("/api/v1/replica/read", ["keys"]),
+        ("/api/v1/replica/read", {"keys": "k"}),
+        ("/api/v1/replica/read", {"prefix": 1}),
+        ("/api/v1/replica/write", ["changes"]),
+        ("/api/v1/replica/write", {"changes": {"k": 1}}),
+        ("/api/v1/replica/write", {"changes": [["k", 1, 2]]}),
+        ("/api/v1/replica/write", {"changes": [["k", True, 2, False]]}),
+    ],
+)
+def test_malformed_replica_payload_is_400(path, payload):
+    async def scenario():
+        app = web.Application()
+        app.router.add_post("/api/v1/replica/read", Cluster.ReplicaRead)
+        app.router.add_post("/api/v1/replica/write", Cluster.ReplicaWrite)
+        async with TestClient(TestServer(app)) as client:
+            response = await client.post(
+                path, json=payload, headers={"X-Node-Token": await Cluster.Token()}
+            )
+            assert response.status == 400
+            assert (await response.json())["Response"].startswith("wrong payload")
+
+    asyncio.run(scenario())
+
+
+def Nodes(tmp_path, monkeypatch, answer):
+    """Swap in a fresh store and two replicas whose `Call` goes to `answer`."""
+    store = VersionStore(str(tmp_path / "output.json"))
+    monkeypatch.setattr(Replication, "Store", store)
+    nodes = ["http://b", "http://c"]
+    monkeypatch.setattr(Replication.Replicator, "Replicas", property(lambda _: nodes))
+    calls = []
+
+    async def Call(node, path, payload):
+        calls.append((node, path, payload))
+        return await answer(node, path, payload)
+
+    monkeypatch.setattr(Cluster, "Call", Call)
+    monkeypatch.setattr(Cluster, "hints", Replication.defaultdict(Replication.deque))
+    return store, calls
+
+
+def test_gather_returns_once_enough_answered():
+    async def scenario():
+        slow = asyncio.Event()
+
+        async def Fast():
+            return "fast"
+
+        async def Slow():
+            await slow.wait()
+            return "slow"
+
+        results = await asyncio.wait_for(Cluster.Gather([Fast(), Slow()], 1), 1)
+        assert results == ["fast"]
+        # the slow call keeps running in the background
+        [task] = [task for task in Cluster.pending if not task.done()]
+        slow.set()
+        assert await task == "slow"
+
+    asyncio.run(scenario())
+
+
+def test_level_header_then_longest_prefix_then_default(monkeypatch):
+    ReplicationCfg = {
+        "ReadConsistency": "QUORUM",
+        "Collections": {"user:": {"read": "ONE"}, "user:admin:": {"read": "ALL"}},
+    }
+    monkeypatch.setattr(
+        Replication.Replicator, "ReplicationCfg", property(lambda _: ReplicationCfg)
+    )
+    assert Cluster.Level("Read", ["user:admin:1"], "one") == "ONE"
+    assert Cluster.Level("Read", ["user:admin:1"]) == "ALL"
+    assert Cluster.Level("Read", ["user:1"]) == "ONE"
+    assert Cluster.Level("Read", ["order:1"]) == "QUORUM"
+    # a batch over several collections takes the strictest level
+    assert Cluster.Level("Read", ["user:1", "order:1"]) == "QUORUM"
+    with pytest.raises(ValidationError):
+        Cluster.Level("Read", ["user:1"], "MOST")
+
+
+def test_read_merges_by_stamp_and_repairs_stale_replicas(tmp_path, monkeypatch):
+    async def answer(node, path, payload):
+        if path == "/api/v1/replica/write":
+            return {"seq": 1}
+        if node == "http://b":
+            return {"k": [20, "new", False], "m": [30, "x", False]}
+        return {"k": [5, "old", False]}
+
+    store, calls = Nodes(tmp_path, monkeypatch, answer)
+
+    async def scenario():
+        await store.Apply([["k", 10, "mine", False]])
+        data = await Cluster.Read(prefix="", level="ALL")
+        assert data == {"k": "new", "m": "x"}
+        await asyncio.gather(*Cluster.pending)
+        # the local store and "c" were behind, "b" had everything
+        assert store.Stamped(keys=["k", "m"]) == {
+            "k": [20, "new", False],
+            "m": [30, "x", False],
+        }
+        [(node, _, payload)] = [call for call in calls if call[1].endswith("write")]
+        assert node == "http://c"
+        assert sorted(payload["changes"]) == [
+            ["k", 20, "new", False],
+            ["m", 30, "x", False],
+        ]
+
+    asyncio.run(scenario())
+
+
+def test_write_below_level_is_503(tmp_path, monkeypatch):
+    async def answer(node, path, payload):
+        if node == "http://c":
+            raise NetworkError("down")
+        return {"seq": 1}
+
+    Nodes(tmp_path, monkeypatch, answer)
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_post("/api/v1/post", RequestHandler().Recive)
+        async with TestClient(TestServer(app)) as client:
+            statuses = []
+            for level in ("QUORUM", "ALL"):
+                response = await client.post(
+                    "/api/v1/post", json={"k": 1}, headers={"X-Consistency": level}
+                )
+                statuses.append(response.status)
+        return statuses
+
+    # two of three replicas answer: enough for QUORUM, not for ALL
+    assert asyncio.run(scenario()) == [200, 503]
+    assert len(Cluster.hints["http://c"]) == 2
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from src import Replication
+from src.JsonHandler import VersionStore
+from src.server import RequestHandler
+
+
+def Requests(calls):
+    """Send `(method, payload)` calls in one event loop, the store is bound to it."""
+
+    async def scenario():
+        app = web.Application()
+        for add in (app.router.add_get, app.router.add_post, app.router.add_delete):
+            add("/api/v1/store", RequestHandler().Recive)
+        answers = []
+        async with TestClient(TestServer(app)) as client:
+            for method, payload in calls:
+                response = await client.request(method, "/api/v1/store", json=payload)
+                answers.append((response.status, await response.json()))
+        return answers
+
+    return asyncio.run(scenario())
+
+
+@pytest.mark.parametrize(
+    "method, payload",
+    [
+        ("POST", ["not", "an", "object"]),
+        ("GET", {"keys": "user:1"}),
+        ("GET", {"keys": [1, 2]}),
+        ("GET", {"prefix": 5}),
+        ("DELETE", {}),
+        ("DELETE", {"keys": [{"a": 1}]}),
+    ],
+)
+def test_malformed_payload_is_400(method, payload):
+    [(status, body)] = Requests([(method, payload)])
+    assert status == 400
+    assert body["Response"].startswith("wrong payload")
+
+
+def test_write_then_read(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    answers = Requests(
+        [
+            ("POST", {"handler-test:1": "a"}),
+            ("GET", {"keys": ["handler-test:1", "handler-test:2"]}),
+            ("DELETE", {"keys": ["handler-test:1"]}),
+            ("GET", {"prefix": "handler-test:"}),
+        ]
+    )
+    assert [status for status, _ in answers] == [200] * 4
+    assert answers[1][1]["Response"]["data"] == {
+        "handler-test:1": "a",
+        "handler-test:2": None,
+    }
+    assert answers[3][1]["Response"]["data"] == {}
+
+
+def test_disk_failure_is_500(tmp_path, monkeypatch):
+    # the parent directory does not exist, so the file write fails
+    store = VersionStore(str(tmp_path / "missing" / "output.json"))
+    monkeypatch.setattr(Replication, "Store", store)
+    [(status, body)] = Requests([("POST", {"handler-test:1": "a"})])
+    assert status == 500
+    assert not body["Response"].startswith("wrong payload")
@@ -0,0 +1,71 @@
+import asyncio
+import logging
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+from src.Tracing import Tracer, Stage, CurrentTrace
+from src.server import Settings, protection
+
+
+def test_nested_stages_kept_apart_and_late_ones_ignored(caplog):
+    trace = {}
+
+    async def Late():
+        await asyncio.sleep(0.02)
+        with Stage("late"):
+            pass
+
+    async def Handler(request):
+        with Stage("replication"):
+            with Stage("JsonHandler.write"):
+                await asyncio.sleep(0.01)
+        trace["request"] = CurrentTrace.get()
+        trace["late"] = asyncio.ensure_future(Late())
+        return web.Response(text="ok")
+
+    async def scenario():
+        Trace = Tracer(Settings, protection())
+        ServerConfig = Settings.Config["Config"]["ServerConfig"]
+        saved = ServerConfig.get("Tracing")
+        ServerConfig["Tracing"] = {"Enabled": True, "SlowRequestMs": 0}
+        try:
+            with caplog.at_level(logging.WARNING, logger="src.Tracing"):
+                await Trace.Tracing(make_mocked_request("GET", "/x"), Handler)
+                await trace["late"]
+        finally:
+            if saved is None:
+                del ServerConfig["Tracing"]
+            else:
+                ServerConfig["Tracing"] = saved
+
+    asyncio.run(scenario())
+    [record] = caplog.records
+    assert "replication=" in record.message
+    assert "replication/JsonHandler.write=" in record.message
+    # the task outlived the request, its stage must not land in the logged trace
+    assert set(trace["request"].stages) == {
+        "replication",
+        "replication/JsonHandler.write",
+    }
+
+
+@pytest.mark.parametrize("seconds", ["nan", "inf", "-inf"])
+def test_profile_rejects_non_finite_seconds(seconds):
+    async def scenario():
+        guard = protection()
+        Trace = Tracer(Settings, guard)
+        token = await guard.TokenHandler(
+            Settings.Config["Config"]["TokenConfig"]["secretKey"]
+        )
+        request = make_mocked_request(
+            "POST",
+            f"/api/v1/admin/profile?seconds={seconds}",
+            headers={"X-Admin-Token": token},
+        )
+        response = await asyncio.wait_for(Trace.Profile(request), 1)
+        assert response.status == 400
+        assert not Trace.profiling
+
+    asyncio.run(scenario())
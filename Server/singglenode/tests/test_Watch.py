@@ -0,0 +1,26 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from src.server import RequestHandler
+from src.JsonHandler import Store
+
+
+def test_websocket_watcher_is_removed_when_client_leaves():
+    async def scenario():
+        app = web.Application()
+        app.router.add_get("/api/v1/watch", RequestHandler().Watch)
+        async with TestClient(TestServer(app)) as client:
+            ws = await client.ws_connect("/api/v1/watch?prefix=watch-test:")
+            await asyncio.sleep(0.05)
+            assert len(Store.feed.subscribers) == 1
+            # nothing is ever published on this prefix, only the close is seen
+            await ws.close()
+            for _ in range(50):
+                if not Store.feed.subscribers:
+                    break
+                await asyncio.sleep(0.01)
+            assert not Store.feed.subscribers
+
+    asyncio.run(scenario())